@@ -6,19 +6,23 @@
 
 const path = require('path');
 
+// Uvicorn worker processes for the MLX API; each loads its own model copy
+const MLX_WORKERS = process.env.MLX_WORKERS || '1';
+
 module.exports = {
   apps: [
     // MLX-LM Python API
     {
       name: 'mlx-api',
       script: 'venv/bin/python',
-      args: '-m uvicorn server:app --host 0.0.0.0 --port 8000',
+      args: `-m uvicorn server:app --host 0.0.0.0 --port 8000 --workers ${MLX_WORKERS} --loop uvloop --http httptools`,
       cwd: path.join(__dirname, 'mlx_api'),
       interpreter: 'none', // Use script directly
       env: {
         MLX_MODEL: 'mlx-community/Llama-3.2-3B-Instruct-4bit',
         MLX_HOST: '0.0.0.0',
         MLX_PORT: '8000',
+        MLX_WORKERS,
       },
       // Restart settings
       autorestart: true,
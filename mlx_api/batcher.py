@@ -0,0 +1,578 @@
+"""
+Continuous batching for MLX generation
+
+Concurrent requests share a single decode loop, so every forward pass
+over the model weights advances all in-flight sequences at once. All MLX
+work runs on one dedicated inference thread, which keeps GPU access
+serialized and leaves the event loop free to serve other endpoints.
+
+Prefill and decode are handled separately. A new prompt is prefilled
+into its own KV cache in chunks of prefill_step_size tokens, one chunk
+between consecutive decode steps, so a long prompt only delays running
+sequences by a chunk at a time. Once only its final token remains, the
+prompt joins the decode batch along with its cache.
+
+The decode batch pads every KV cache to the longest one, so prefilled
+prompts are grouped into length buckets and each step fills free slots
+from a single bucket: the one the running sequences' lengths fall in,
+or the fullest when nothing is running. A prompt that has waited longer
+than batch_wait_ms is admitted regardless of its bucket.
+
+Requests are queued as live (an HTTP client is waiting) or background
+(bulk jobs). Background prompts are only admitted while no live prompt is
+waiting and the batch has free slots, so they soak up idle capacity
+without delaying live replies.
+
+A BatchGenerator applies one sampler to its whole batch, so sequences are
+grouped by sampling parameters with one generator per group. Clients
+normally share a temperature and top_p, leaving a single group.
+
+With a draft model, a request arriving while the batcher is idle is
+decoded speculatively instead: the draft model proposes a few tokens and
+the main model verifies them in a single forward pass. This pays off for
+a lone sequence, where decoding is bound by reading the weights; requests
+arriving meanwhile are batched as usual alongside it.
+"""
+import asyncio
+import itertools
+import logging
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional
+
+import mlx.core as mx
+from mlx_lm.generate import BatchGenerator, speculative_generate_step
+from mlx_lm.models.cache import cache_length, make_prompt_cache
+
+from sampling import make_sampler
+
+logger = logging.getLogger("mlx-api.batcher")
+
+# (temperature, top_p)
+SamplingParams = tuple[float, float]
+
+# Queue priorities, lowest first
+LIVE = 0
+BACKGROUND = 1
+
+# Key of the speculative sequence in Batcher.active
+SPECULATIVE = (None, 0)
+
+
+@dataclass
+class GenerationResult:
+    """Completed generation for a single prompt"""
+    text: str
+    tokens: list[int]
+    finish_reason: str
+    # KV cache covering the prompt and generated tokens, for reuse; not
+    # kept for background requests, whose results can sit in memory
+    prompt_cache: Optional[list[Any]] = None
+
+
+@dataclass
+class PendingRequest:
+    """Prompt waiting to join the decode batch"""
+    prompt_tokens: list[int]
+    max_tokens: int
+    sampling: SamplingParams
+    future: asyncio.Future
+    # Receives decoded text segments as they are produced, then None
+    stream: Optional[asyncio.Queue] = None
+    # KV cache already holding the tokens that precede prompt_tokens
+    cache: Optional[list[Any]] = None
+    priority: int = LIVE
+    # Decode with the draft model; the cache then also holds the draft
+    # model's layers after the main model's
+    speculative: bool = False
+    # Loop time at which prefill finished
+    ready_at: float = 0
+    # Prompt length in tokens, including cached ones, once prefilled
+    length: int = 0
+
+
+@dataclass
+class ActiveSequence:
+    """Sequence currently being decoded"""
+    request: PendingRequest
+    uid: int
+    tokens: list[int] = field(default_factory=list)
+    detokenizer: Any = None
+
+
+@dataclass
+class SpeculativeDecode:
+    """State of the sequence being decoded with the draft model"""
+    steps: Iterator
+    cache: list[Any]
+    max_tokens: int
+    produced: int = 0
+
+
+class Batcher:
+    """Groups pending prompts into shared BatchGenerator decode loops"""
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int,
+        batch_wait_ms: int,
+        prefill_step_size: int,
+        length_bucket: int,
+        draft_model=None,
+        num_draft_tokens: int = 3
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.prefill_step_size = prefill_step_size
+        self.length_bucket = length_bucket
+        # (priority, arrival order, request)
+        self.queue: asyncio.PriorityQueue[tuple[int, int, PendingRequest]] = asyncio.PriorityQueue()
+        self._arrivals = itertools.count()
+        # Prompts whose cache is still being filled, in arrival order
+        self.prefilling: list[PendingRequest] = []
+        # Prefilled prompts waiting for a decode slot, by length bucket
+        self.ready: dict[int, deque[PendingRequest]] = {}
+        # Prompts admitted to the decode batch per length bucket
+        self.bucket_hits: Counter[int] = Counter()
+        self.active: dict[tuple[SamplingParams, int], ActiveSequence] = {}
+        self.generators: dict[SamplingParams, BatchGenerator] = {}
+        self.speculative: Optional[SpeculativeDecode] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx-inference")
+        self._task: Optional[asyncio.Task] = None
+
+    def _new_generator(self, sampling: SamplingParams) -> BatchGenerator:
+        temperature, top_p = sampling
+        return BatchGenerator(
+            self.model,
+            stop_tokens=self.tokenizer.eos_token_ids,
+            sampler=make_sampler(temperature, top_p),
+            completion_batch_size=self.max_batch_size,
+            # Admit waiting prompts as soon as any slot frees up
+            prefill_batch_size=1,
+        )
+
+    def start(self):
+        """Start the background inference loop"""
+        self._task = asyncio.create_task(self.inference_coroutine())
+
+    async def stop(self):
+        """Stop the inference loop and fail any outstanding requests"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        error = RuntimeError("Server shutting down")
+        self._fail_active(error)
+        self._fail_waiting(error)
+        while not self.queue.empty():
+            self._fail(self.queue.get_nowait()[-1], error)
+        await self.run_in_thread(self._close_generators)
+        self._executor.shutdown()
+
+    def can_speculate(self) -> bool:
+        """Whether a request queued now should be decoded speculatively"""
+        return (
+            self.draft_model is not None
+            and not self.active
+            and not self._waiting()
+            and self.queue.empty()
+        )
+
+    def stats(self) -> dict:
+        """Length bucket histogram for the /stats endpoint"""
+        width = self.length_bucket
+        return {
+            "length_bucket_width": width,
+            "length_buckets": {
+                f"{b * width}-{(b + 1) * width - 1}": n
+                for b, n in sorted(self.bucket_hits.items())
+            }
+        }
+
+    async def run_in_thread(self, fn: Callable, *args):
+        """Run a blocking MLX call on the inference thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def enqueue(
+        self,
+        prompt_tokens: list[int],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        stream: Optional[asyncio.Queue] = None,
+        cache: Optional[list[Any]] = None,
+        priority: int = LIVE,
+        speculative: bool = False
+    ) -> PendingRequest:
+        """
+        Queue a prompt for generation.
+
+        The returned request's future resolves to a GenerationResult. When
+        a stream queue is given, text segments are also pushed to it as
+        tokens are decoded, followed by None once the sequence ends. When
+        a cache is given, prompt_tokens are only the tokens it does not
+        already hold. Cancelling the future drops the sequence from the
+        batch. BACKGROUND priority defers the prompt while live prompts
+        are waiting or the batch is full. A speculative request's cache
+        must also hold the draft model's layers; without them it is
+        batched normally instead.
+        """
+        layers = len(self.model.layers)
+        if cache is not None:
+            if len(cache) == layers:
+                # The draft model would have to prefill the whole prompt
+                speculative = False
+            elif not speculative:
+                cache = cache[:layers]
+        future = asyncio.get_running_loop().create_future()
+        pending = PendingRequest(
+            prompt_tokens,
+            max_tokens,
+            (temperature, top_p),
+            future,
+            stream,
+            cache,
+            priority,
+            speculative
+        )
+        self.queue.put_nowait((priority, next(self._arrivals), pending))
+        return pending
+
+    async def submit(
+        self,
+        prompt_tokens: list[int],
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        cache: Optional[list[Any]] = None,
+        speculative: bool = False
+    ) -> GenerationResult:
+        """Queue a prompt for generation and wait for the completed sequence"""
+        return await self.enqueue(
+            prompt_tokens,
+            max_tokens,
+            temperature,
+            top_p,
+            cache=cache,
+            speculative=speculative
+        ).future
+
+    async def inference_coroutine(self):
+        """
+        Drain the queue, prefill one chunk and advance the batch one step
+        per iteration
+        """
+        while True:
+            if not self.active and not self.prefilling and not self.ready:
+                # Idle: block until work arrives, then give concurrent
+                # requests a short window to join the same batch
+                self.prefilling.append((await self.queue.get())[-1])
+                if self.batch_wait > 0:
+                    await asyncio.sleep(self.batch_wait)
+
+            self._admit()
+
+            self.prefilling = [p for p in self.prefilling if not p.future.cancelled()]
+            cancelled = self._pop_cancelled()
+            try:
+                await self.run_in_thread(self._prefill)
+                # Prompts down to their final token are ready to decode
+                now = asyncio.get_running_loop().time()
+                for p in self.prefilling:
+                    if len(p.prompt_tokens) == 1:
+                        self._add_ready(p, now)
+                self.prefilling = [p for p in self.prefilling if len(p.prompt_tokens) > 1]
+                pending = self._take_ready(now)
+                in_use = {key[0] for key in self.active} | {p.sampling for p in pending}
+                responses = await self.run_in_thread(self._step, cancelled, pending, in_use)
+            except Exception as e:
+                logger.error(f"Batch step failed: {e}", exc_info=True)
+                self._fail_active(e)
+                self._fail_waiting(e)
+                await self.run_in_thread(self._reset)
+                continue
+
+            for sampling, r in responses:
+                seq = self.active.get((sampling, r.uid))
+                if seq is None:
+                    continue
+                # The stop token itself is not part of the response
+                if r.finish_reason != "stop":
+                    seq.tokens.append(r.token)
+                    if seq.detokenizer is not None:
+                        seq.detokenizer.add_token(r.token)
+                        self._push_segment(seq)
+                if r.finish_reason is not None:
+                    del self.active[(sampling, r.uid)]
+                    self._complete(seq, r.finish_reason, r.prompt_cache)
+
+    def _admit(self):
+        """Move queued prompts to prefill, holding back background work"""
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item[-1].priority == BACKGROUND and not self._has_spare_capacity():
+                # Priority order means the rest of the queue is background too
+                self.queue.put_nowait(item)
+                break
+            self.prefilling.append(item[-1])
+
+    def _waiting(self) -> list[PendingRequest]:
+        """Admitted prompts not yet in the decode batch"""
+        return self.prefilling + [p for queue in self.ready.values() for p in queue]
+
+    def _has_spare_capacity(self) -> bool:
+        waiting = self._waiting()
+        return (
+            all(p.priority == BACKGROUND for p in waiting)
+            and len(self.active) + len(waiting) < self.max_batch_size
+        )
+
+    def _add_ready(self, p: PendingRequest, now: float):
+        p.length = len(p.prompt_tokens) + (cache_length(p.cache) if p.cache else 0)
+        p.ready_at = now
+        self.ready.setdefault(p.length // self.length_bucket, deque()).append(p)
+
+    def _take_ready(self, now: float) -> list[PendingRequest]:
+        """
+        Pick prefilled prompts for the free decode slots.
+
+        Buckets whose oldest prompt has waited past batch_wait are taken
+        first, oldest first. When none has, a single bucket is taken: the
+        one most running sequences' lengths fall in, or the fullest if
+        none do. Other buckets wait for a later step.
+        """
+        free = self.max_batch_size - len(self.active)
+        overdue = sorted(
+            (b for b, queue in self.ready.items() if now - queue[0].ready_at >= self.batch_wait),
+            key=lambda b: self.ready[b][0].ready_at
+        )
+        if overdue:
+            buckets = overdue
+        elif self.ready:
+            running = Counter(
+                (seq.request.length + len(seq.tokens)) // self.length_bucket
+                for key, seq in self.active.items()
+                if key != SPECULATIVE
+            )
+            buckets = [max(self.ready, key=lambda b: (running[b], len(self.ready[b])))]
+        else:
+            buckets = []
+
+        taken = []
+        for bucket in buckets:
+            queue = self.ready[bucket]
+            while queue and len(taken) < free:
+                p = queue.popleft()
+                if not p.future.cancelled():
+                    taken.append(p)
+                    self.bucket_hits[bucket] += 1
+            if not queue:
+                del self.ready[bucket]
+        return taken
+
+    def _prefill(self):
+        """
+        Feed up to prefill_step_size prompt tokens into the caches of
+        waiting prompts, oldest first (inference thread)
+        """
+        budget = self.prefill_step_size
+        for p in self.prefilling:
+            n = min(budget, len(p.prompt_tokens) - 1)
+            if n <= 0:
+                continue
+            if p.cache is None:
+                p.cache = self._new_cache(p)
+            chunk = mx.array(p.prompt_tokens[:n])[None]
+            self.model(chunk, cache=p.cache[:len(self.model.layers)])
+            if p.speculative:
+                self.draft_model(chunk, cache=p.cache[len(self.model.layers):])
+            mx.eval([c.state for c in p.cache])
+            p.prompt_tokens = p.prompt_tokens[n:]
+            budget -= n
+            if budget == 0:
+                break
+        # Release prefill activations, but leave MLX's buffer cache alone
+        # on pure decode steps
+        if budget < self.prefill_step_size:
+            mx.clear_cache()
+
+    def _step(
+        self,
+        cancelled: list[tuple[SamplingParams, int]],
+        pending: list[PendingRequest],
+        in_use: set[SamplingParams]
+    ) -> list[tuple[SamplingParams, BatchGenerator.Response]]:
+        """
+        Update batch membership, decode one token per group and run one
+        draft-and-verify round of the speculative sequence (inference
+        thread)
+        """
+        for sampling, uid in cancelled:
+            if (sampling, uid) == SPECULATIVE:
+                self._stop_speculative()
+            else:
+                self.generators[sampling].remove([uid])
+        for sampling in list(self.generators):
+            if sampling not in in_use:
+                self.generators.pop(sampling).close()
+        self._insert(pending)
+
+        responses = [
+            (sampling, r)
+            for sampling, generator in self.generators.items()
+            for r in generator.next()
+        ]
+        if self.speculative is not None:
+            responses += [(SPECULATIVE[0], r) for r in self._speculate()]
+        return responses
+
+    def _new_cache(self, p: PendingRequest) -> list[Any]:
+        cache = make_prompt_cache(self.model)
+        if p.speculative:
+            cache += make_prompt_cache(self.draft_model)
+        return cache
+
+    def _start_speculative(self, p: PendingRequest):
+        cache = p.cache or self._new_cache(p)
+        self.speculative = SpeculativeDecode(
+            steps=speculative_generate_step(
+                mx.array(p.prompt_tokens),
+                self.model,
+                self.draft_model,
+                num_draft_tokens=self.num_draft_tokens,
+                max_tokens=p.max_tokens,
+                sampler=make_sampler(*p.sampling),
+                prompt_cache=cache,
+                prefill_step_size=self.prefill_step_size
+            ),
+            cache=cache,
+            max_tokens=p.max_tokens
+        )
+
+    def _speculate(self) -> list[BatchGenerator.Response]:
+        """Tokens from one draft-and-verify round, as batch responses"""
+        spec = self.speculative
+        responses = []
+        # Accepted draft tokens come first; a round ends with a token
+        # sampled from the main model
+        for token, logprobs, from_draft in spec.steps:
+            spec.produced += 1
+            finish_reason = None
+            if token in self.tokenizer.eos_token_ids:
+                finish_reason = "stop"
+            elif spec.produced >= spec.max_tokens:
+                finish_reason = "length"
+            responses.append(BatchGenerator.Response(
+                SPECULATIVE[1], token, logprobs, finish_reason, spec.cache if finish_reason else None
+            ))
+            if finish_reason is not None:
+                self._stop_speculative()
+                break
+            if not from_draft:
+                break
+        return responses
+
+    def _stop_speculative(self):
+        if self.speculative is not None:
+            # Closing the step generator rewinds unverified draft tokens
+            self.speculative.steps.close()
+            self.speculative = None
+
+    def _close_generators(self):
+        """Release all generators (inference thread)"""
+        for generator in self.generators.values():
+            generator.close()
+        self.generators.clear()
+        self._stop_speculative()
+
+    def _reset(self):
+        """Drop all generators after a failed step (inference thread)"""
+        self._close_generators()
+
+    def _insert(self, pending: list[PendingRequest]):
+        """Add prefilled prompts to the decode batch (inference thread)"""
+        for p in pending:
+            if p.speculative and self.speculative is None:
+                self._start_speculative(p)
+                self._activate(p, SPECULATIVE)
+                continue
+            if p.speculative and p.cache is not None:
+                # Another sequence got there first; batch this one and
+                # drop its draft model cache
+                p.cache = p.cache[:len(self.model.layers)]
+
+            generator = self.generators.get(p.sampling)
+            if generator is None:
+                generator = self.generators[p.sampling] = self._new_generator(p.sampling)
+            (uid,) = generator.insert(
+                [p.prompt_tokens],
+                max_tokens=[p.max_tokens],
+                caches=[p.cache or make_prompt_cache(self.model)],
+            )
+            self._activate(p, (p.sampling, uid))
+        if pending:
+            logger.debug(f"Inserted {len(pending)} prompts ({len(self.active)} active)")
+
+    def _activate(self, p: PendingRequest, key: tuple):
+        seq = ActiveSequence(request=p, uid=key[1])
+        if p.stream is not None:
+            seq.detokenizer = self.tokenizer.detokenizer
+            seq.detokenizer.reset()
+        self.active[key] = seq
+
+    def _pop_cancelled(self) -> list[tuple[SamplingParams, int]]:
+        cancelled = [key for key, seq in self.active.items() if seq.request.future.cancelled()]
+        for key in cancelled:
+            del self.active[key]
+        if cancelled:
+            logger.debug(f"Dropping {len(cancelled)} cancelled sequences")
+        return cancelled
+
+    def _push_segment(self, seq: ActiveSequence):
+        segment = seq.detokenizer.last_segment
+        if segment:
+            seq.request.stream.put_nowait(segment)
+
+    def _complete(self, seq: ActiveSequence, finish_reason: str, prompt_cache: Optional[list[Any]]):
+        request = seq.request
+        if request.stream is not None:
+            seq.detokenizer.finalize()
+            self._push_segment(seq)
+            request.stream.put_nowait(None)
+        if request.priority == BACKGROUND:
+            prompt_cache = None
+        if not request.future.done():
+            request.future.set_result(GenerationResult(
+                text=self.tokenizer.decode(seq.tokens),
+                tokens=seq.tokens,
+                finish_reason=finish_reason,
+                prompt_cache=prompt_cache
+            ))
+
+    def _fail(self, request: PendingRequest, error: Exception):
+        if request.stream is not None:
+            request.stream.put_nowait(None)
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def _fail_waiting(self, error: Exception):
+        for p in self._waiting():
+            self._fail(p, error)
+        self.prefilling.clear()
+        self.ready.clear()
+
+    def _fail_active(self, error: Exception):
+        for seq in self.active.values():
+            self._fail(seq.request, error)
+        self.active.clear()
@@ -0,0 +1,64 @@
+"""
+Precompiled chat template rendering
+
+Mirrors the Jinja environment transformers builds for apply_chat_template,
+but compiles the template once at startup instead of on every request.
+"""
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from jinja2 import Template
+from jinja2.exceptions import TemplateError
+from jinja2.ext import loopcontrols
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+logger = logging.getLogger("mlx-api.chat_template")
+
+
+def _raise_exception(message: str):
+    raise TemplateError(message)
+
+
+def _tojson(x, ensure_ascii=False, indent=None, separators=None, sort_keys=False):
+    return json.dumps(
+        x,
+        ensure_ascii=ensure_ascii,
+        indent=indent,
+        separators=separators,
+        sort_keys=sort_keys
+    )
+
+
+def _strftime_now(format: str) -> str:
+    return datetime.now().strftime(format)
+
+
+def compile_chat_template(tokenizer) -> Optional[Template]:
+    """
+    Compile the tokenizer's chat template.
+
+    Returns None when the tokenizer has no template or it cannot be
+    compiled here, in which case callers fall back to apply_chat_template.
+    """
+    source = tokenizer.chat_template
+    if isinstance(source, dict):
+        source = source.get("default")
+    if not source:
+        return None
+
+    env = ImmutableSandboxedEnvironment(
+        trim_blocks=True,
+        lstrip_blocks=True,
+        extensions=[loopcontrols]
+    )
+    env.filters["tojson"] = _tojson
+    env.globals["raise_exception"] = _raise_exception
+    env.globals["strftime_now"] = _strftime_now
+
+    try:
+        return env.from_string(source)
+    except TemplateError as e:
+        logger.warning(f"Could not precompile chat template, using apply_chat_template: {e}")
+        return None
@@ -3,9 +3,10 @@ MLX API Configuration
 """
 import os
 from dataclasses import dataclass
+from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     """MLX API Configuration"""
 
@@ -15,9 +16,33 @@ class Config:
         "mlx-community/Llama-3.2-3B-Instruct-4bit"
     )
 
+    # Quantize weights to this many bits at startup (0 = load as is).
+    # The quantized copy is saved and reused on later startups.
+    quantize_bits: int = int(os.getenv("MLX_QUANTIZE_BITS", "0"))
+    quantize_group_size: int = int(os.getenv("MLX_QUANTIZE_GROUP_SIZE", "64"))
+    quantized_model_dir: str = os.getenv("MLX_QUANTIZED_MODEL_DIR", "~/.cache/mlx-api")
+
+    # Upper bound on memory MLX keeps cached for reuse after it is freed
+    # (0 = MLX default)
+    cache_limit_mb: int = int(os.getenv("MLX_CACHE_LIMIT_MB", "0"))
+
+    # Small model sharing the main model's tokenizer, used to draft
+    # tokens for speculative decoding when the server is otherwise idle
+    draft_model_id: Optional[str] = os.getenv("MLX_DRAFT_MODEL") or None
+    # Tokens drafted per verification step
+    speculative_k: int = int(os.getenv("MLX_SPECULATIVE_K", "3"))
+
+    # Prompt encoding backend: "default" (Hugging Face) or "tiktoken"
+    tokenizer_backend: str = os.getenv("MLX_TOKENIZER_BACKEND", "default")
+
     # Server settings
     host: str = os.getenv("MLX_HOST", "0.0.0.0")
     port: int = int(os.getenv("MLX_PORT", "8000"))
+    # Each worker process loads its own copy of the model (MLX weight
+    # buffers are not shared across processes) and has its own batcher,
+    # prompt cache and /batch jobs. On a single Mac prefer 1 worker +
+    # batching.
+    workers: int = int(os.getenv("MLX_WORKERS", "1"))
 
     # Generation defaults
     default_max_tokens: int = int(os.getenv("MLX_MAX_TOKENS", "512"))
@@ -27,7 +52,23 @@ class Config:
     # Safety limits
     max_input_tokens: int = int(os.getenv("MLX_MAX_INPUT_TOKENS", "2048"))
     max_output_tokens: int = int(os.getenv("MLX_MAX_OUTPUT_TOKENS", "1024"))
-    request_timeout: int = int(os.getenv("MLX_REQUEST_TIMEOUT", "60"))
+    # Seconds; MLX_REQUEST_TIMEOUT is the Node client's timeout in ms
+    request_timeout: int = int(os.getenv("MLX_GENERATION_TIMEOUT", "60"))
+    max_inflight: int = int(os.getenv("MLX_MAX_INFLIGHT", "8"))
+
+    # Continuous batching
+    max_batch_size: int = int(os.getenv("MLX_MAX_BATCH_SIZE", "8"))
+    batch_wait_ms: int = int(os.getenv("MLX_BATCH_WAIT_MS", "5"))
+    # Prompt tokens prefilled between two decode steps
+    prefill_step_size: int = int(os.getenv("MLX_PREFILL_STEP_SIZE", "512"))
+    # Prompts are grouped by length in buckets of this many tokens
+    length_bucket: int = int(os.getenv("MLX_LENGTH_BUCKET", "128"))
+
+    # Background /batch jobs kept at once (finished jobs are evicted first)
+    max_batch_jobs: int = int(os.getenv("MLX_MAX_BATCH_JOBS", "32"))
+
+    # Conversations whose KV cache is kept for reuse on the next turn
+    max_cached_convs: int = int(os.getenv("MLX_MAX_CACHED_CONVS", "8"))
 
 
 config = Config()
@@ -0,0 +1,23 @@
+"""
+Prometheus metrics, served at /metrics
+
+With several worker processes each worker reports its own values.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+GENERATE_LATENCY = Histogram(
+    "mlx_generate_latency_seconds",
+    "Time spent on non-streamed generation requests, including timeouts and failures",
+    ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+)
+
+TOKENS_GENERATED = Counter(
+    "mlx_tokens_generated",
+    "Tokens generated across all endpoints"
+)
+
+INFLIGHT = Gauge(
+    "mlx_inflight_requests",
+    "Requests holding an in-flight generation slot"
+)
@@ -1,35 +1,51 @@
 """
-Pydantic models for MLX API requests and responses
+Request and response models for the MLX API
+
+Request bodies are msgspec Structs decoded by prebuilt decoders on the
+hot path; responses stay Pydantic models for the OpenAPI documentation.
 """
+from typing import Annotated, Optional
+
+import msgspec
 from pydantic import BaseModel, Field
-from typing import Optional
 
 
-class Message(BaseModel):
+class Message(msgspec.Struct):
     """Single message in conversation"""
-    role: str = Field(..., description="Role: 'system', 'user', or 'assistant'")
-    content: str = Field(..., description="Message content")
+    role: Annotated[str, msgspec.Meta(description="Role: 'system', 'user', or 'assistant'")]
+    content: Annotated[str, msgspec.Meta(description="Message content")]
 
 
-class GenerateRequest(BaseModel):
+class GenerateRequest(msgspec.Struct):
     """Request body for /generate endpoint"""
-    messages: list[Message] = Field(..., description="Conversation messages")
-    max_tokens: int = Field(default=512, ge=1, le=2048)
-    temperature: float = Field(default=0.7, ge=0.0, le=2.0)
-    top_p: float = Field(default=0.9, ge=0.0, le=1.0)
-
-    model_config = {
-        "json_schema_extra": {
-            "examples": [{
-                "messages": [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": "Hello, how are you?"}
-                ],
-                "max_tokens": 256,
-                "temperature": 0.7
-            }]
-        }
-    }
+    messages: Annotated[list[Message], msgspec.Meta(
+        description="Conversation messages",
+        examples=[[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Hello, how are you?"}
+        ]]
+    )]
+    max_tokens: Annotated[int, msgspec.Meta(ge=1, le=2048)] = 512
+    temperature: Annotated[float, msgspec.Meta(ge=0.0, le=2.0)] = 0.7
+    top_p: Annotated[float, msgspec.Meta(ge=0.0, le=1.0)] = 0.9
+
+
+class ChatCompletionRequest(GenerateRequest):
+    """Request body for the OpenAI-compatible /v1/chat/completions endpoint"""
+    model: Annotated[Optional[str], msgspec.Meta(description="Ignored; the loaded model is always used")] = None
+    stream: Annotated[bool, msgspec.Meta(description="Stream tokens as server-sent events")] = False
+
+
+# Request body for /batch
+BatchRequest = Annotated[list[GenerateRequest], msgspec.Meta(
+    min_length=1,
+    max_length=256,
+    description="Prompts to generate in the background"
+)]
+
+
+# Request bodies documented in the OpenAPI schema components
+REQUEST_MODELS = (GenerateRequest, ChatCompletionRequest)
 
 
 class GenerateResponse(BaseModel):
@@ -40,6 +56,25 @@ class GenerateResponse(BaseModel):
     model: str = Field(..., description="Model used for generation")
 
 
+class BatchResult(BaseModel):
+    """Outcome of one prompt in a batch job"""
+    response: Optional[str] = Field(None, description="Generated text")
+    tokens_generated: int = Field(0, description="Number of tokens generated")
+    error: Optional[str] = Field(None, description="Why generation failed")
+
+
+class BatchJobResponse(BaseModel):
+    """Response body for /batch endpoints"""
+    job_id: str
+    status: str = Field(..., description="'running' or 'completed'")
+    completed: int = Field(..., description="Prompts finished so far")
+    total: int = Field(..., description="Prompts in the job")
+    results: Optional[list[BatchResult]] = Field(
+        None,
+        description="Results in request order, once the job has completed"
+    )
+
+
 class HealthResponse(BaseModel):
     """Response body for /health endpoint"""
     status: str
@@ -0,0 +1,102 @@
+"""
+Per-conversation KV cache reuse
+
+After a reply is generated, its KV cache is kept under a key derived from
+the conversation including that reply. When the next turn arrives, the
+cache for everything before the newest message is looked up, trimmed to
+the prefix it shares with the new prompt, and only the remaining tokens
+need to be prefilled.
+
+A cache from a speculative turn also holds the draft model's layers
+after the main model's, so the next turn can keep speculating.
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Optional
+
+from mlx_lm.models.cache import can_trim_prompt_cache, trim_prompt_cache
+
+logger = logging.getLogger("mlx-api.prompt_cache")
+
+
+def conversation_key(messages: list[dict]) -> str:
+    """Stable key for a list of chat messages"""
+    serialized = json.dumps(messages, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(serialized.encode()).hexdigest()
+
+
+def _common_prefix(a: list[int], b: list[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PromptCacheStore:
+    """LRU of KV caches keyed by conversation"""
+
+    def __init__(self, model, max_entries: int):
+        self.model = model
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[list[int], list[Any]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def stats(self) -> dict:
+        """Counters for the /stats endpoint"""
+        return {
+            "conversations": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens
+        }
+
+    def fetch(self, key: str, prompt_tokens: list[int]) -> tuple[Optional[list[Any]], int]:
+        """
+        Take a cache for prompt_tokens.
+
+        Returns the cache and how many leading prompt tokens it already
+        holds. The entry leaves the store, since generation extends the
+        cache in place; None is returned on a miss.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            cached_tokens, cache = entry
+            # Always leave at least one prompt token to prefill
+            reused = min(_common_prefix(cached_tokens, prompt_tokens), len(prompt_tokens) - 1)
+            excess = len(cached_tokens) - reused
+            if reused > 0 and (excess == 0 or can_trim_prompt_cache(cache)):
+                trim_prompt_cache(cache, excess)
+                self.hits += 1
+                self.reused_tokens += reused
+                return cache, reused
+
+        self.misses += 1
+        return None, 0
+
+    def store(self, key: str, tokens: list[int], cache: list[Any]):
+        """Keep a cache whose contents correspond to tokens"""
+        if self.max_entries <= 0 or not cache:
+            return
+
+        # The cache can hold fewer tokens than were produced (the final
+        # token is never fed back) or one more (the stop token), and
+        # draft model layers can be a token behind the main model's.
+        # Trim every model's layers to the same length
+        models = [cache[:len(self.model.layers)], cache[len(self.model.layers):]]
+        models = [layers for layers in models if layers]
+        offset = min(len(tokens), *(layers[0].offset for layers in models))
+        for layers in models:
+            if layers[0].offset > offset:
+                if not can_trim_prompt_cache(layers):
+                    return
+                trim_prompt_cache(layers, layers[0].offset - offset)
+
+        self._entries[key] = (tokens[:offset], cache)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
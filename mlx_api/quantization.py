@@ -0,0 +1,58 @@
+"""
+Weight quantization at load time
+
+Decoding reads every weight once per token, so its speed scales roughly
+with the size of the weights. When MLX_QUANTIZE_BITS is set and the
+checkpoint is not quantized already, its weights are quantized once,
+saved under MLX_QUANTIZED_MODEL_DIR, and loaded from there on later
+startups.
+
+MLX quantizes weights only; activations stay in the model's dtype.
+"""
+import logging
+from pathlib import Path
+
+import mlx.core as mx
+from mlx_lm import load
+from mlx_lm.utils import quantize_model, save
+
+logger = logging.getLogger("mlx-api.quantization")
+
+SUPPORTED_BITS = (2, 3, 4, 5, 6, 8)
+
+
+def quantized_path(model_id: str, bits: int, group_size: int, save_dir: str) -> Path:
+    """Where the quantized copy of model_id is kept"""
+    name = model_id.strip("/").replace("/", "--")
+    return Path(save_dir).expanduser() / f"{name}-{bits}bit-g{group_size}"
+
+
+def load_model(model_id: str, bits: int, group_size: int, save_dir: str):
+    """
+    Load model_id, quantized to the given bits when bits is non-zero.
+
+    Returns the model and tokenizer as mlx_lm.load does.
+    """
+    if not bits:
+        return load(model_id)
+    if bits not in SUPPORTED_BITS:
+        raise ValueError(f"Unsupported quantization bits: {bits} (expected one of {SUPPORTED_BITS})")
+
+    path = quantized_path(model_id, bits, group_size, save_dir)
+    if (path / "config.json").exists():
+        logger.info(f"Loading quantized model from {path}")
+        return load(str(path))
+
+    model, tokenizer, model_config = load(model_id, lazy=True, return_config=True)
+    if "quantization" in model_config:
+        logger.info(f"{model_id} is already quantized, loading as is")
+        mx.eval(model.parameters())
+        return model, tokenizer
+
+    logger.info(f"Quantizing {model_id} to {bits}-bit (group size {group_size})")
+    model, model_config = quantize_model(model, model_config, group_size, bits)
+    save(path, model_id, model, tokenizer, model_config)
+    logger.info(f"Saved quantized model to {path}")
+
+    # Saving donates the weights, so read them back from disk
+    return load(str(path))
@@ -11,13 +11,18 @@ source ../venv/bin/activate
 export MLX_MODEL="${MLX_MODEL:-mlx-community/Llama-3.2-3B-Instruct-4bit}"
 export MLX_HOST="${MLX_HOST:-0.0.0.0}"
 export MLX_PORT="${MLX_PORT:-8000}"
+export MLX_WORKERS="${MLX_WORKERS:-1}"
 
 echo "Starting MLX API Server..."
 echo "Model: $MLX_MODEL"
 echo "Endpoint: http://$MLX_HOST:$MLX_PORT"
+echo "Workers: $MLX_WORKERS"
 
 # Start server
 python -m uvicorn server:app \
     --host "$MLX_HOST" \
     --port "$MLX_PORT" \
+    --workers "$MLX_WORKERS" \
+    --loop uvloop \
+    --http httptools \
     --log-level info
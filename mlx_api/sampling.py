@@ -0,0 +1,55 @@
+"""
+Compiled token sampling
+
+Temperature scaling, top-p filtering and the categorical draw run as one
+compiled MLX graph per decode step. Temperature and top_p are passed as
+arrays rather than Python floats, so every sampling setting shares the
+same compiled graph instead of being traced again per value; MLX only
+retraces for new batch shapes.
+"""
+import math
+from functools import partial
+from typing import Callable
+
+import mlx.core as mx
+
+
+@partial(mx.compile, inputs=mx.random.state, outputs=mx.random.state)
+def sample(logprobs: mx.array, temperature: mx.array, top_p: mx.array) -> mx.array:
+    """
+    Sample one token per row of logprobs.
+
+    Greedy when temperature is 0. top_p outside (0, 1) disables nucleus
+    filtering, matching mlx_lm's make_sampler.
+    """
+    # Nucleus filtering: keep the smallest set of tokens whose
+    # probabilities sum to at least top_p
+    top_p = mx.where((top_p > 0) & (top_p < 1), top_p, 1.0)
+    probs = mx.exp(logprobs)
+    sorted_indices = mx.argsort(logprobs, axis=-1)
+    sorted_probs = mx.take_along_axis(probs, sorted_indices, axis=-1)
+    cumulative_probs = mx.cumsum(sorted_probs, axis=-1)
+    inverse_indices = mx.put_along_axis(
+        mx.zeros_like(sorted_indices),
+        sorted_indices,
+        mx.arange(sorted_indices.shape[-1], dtype=sorted_indices.dtype),
+        axis=-1
+    )
+    cumulative_probs = mx.take_along_axis(cumulative_probs, inverse_indices, axis=-1)
+    filtered = mx.where(cumulative_probs > 1 - top_p, logprobs, -float("inf"))
+
+    sampled = mx.random.categorical(filtered * (1 / mx.maximum(temperature, 1e-6)))
+    return mx.where(temperature == 0, mx.argmax(logprobs, axis=-1), sampled)
+
+
+def make_sampler(temperature: float, top_p: float) -> Callable[[mx.array], mx.array]:
+    """Sampler for BatchGenerator using the compiled sample function"""
+    temperature = mx.array(temperature, dtype=mx.float32)
+    top_p = mx.array(top_p, dtype=mx.float32)
+    return lambda logprobs: sample(logprobs, temperature, top_p)
+
+
+def warmup_sampler(vocab_size: int):
+    """Trace the compiled sampler before the first request needs it"""
+    logprobs = mx.full((1, vocab_size), -math.log(vocab_size))
+    mx.eval(make_sampler(0.7, 0.9)(logprobs))
@@ -3,22 +3,42 @@ MLX-LM FastAPI Server for iMessage Chatbot
 Provides local LLM inference on Apple Silicon via MLX
 """
 
+import re
 import time
+import functools
+import uuid
+import asyncio
 import logging
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Callable, Optional
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-
-from mlx_lm import load, generate
-
+from fastapi.openapi.utils import get_openapi
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import mlx.core as mx
+import msgspec
+import orjson
+from prometheus_client import make_asgi_app
+
+from batcher import BACKGROUND, Batcher, GenerationResult
+from chat_template import compile_chat_template
+from prompt_cache import PromptCacheStore, conversation_key
+from metrics import GENERATE_LATENCY, INFLIGHT, TOKENS_GENERATED
+from quantization import load_model
+from sampling import warmup_sampler
+from tokenizer_backend import build_encoder
 from models import (
+    BatchJobResponse,
+    BatchRequest,
+    ChatCompletionRequest,
     GenerateRequest,
     GenerateResponse,
     HealthResponse,
-    ErrorResponse
+    ErrorResponse,
+    REQUEST_MODELS
 )
 from config import config
 
@@ -33,9 +53,19 @@ logger = logging.getLogger("mlx-api")
 # Global state
 class ModelState:
     model = None
+    draft_model = None
     tokenizer = None
+    encode = None
+    compiled_template = None
+    template_vars: dict = {}
+    segmented_encoding: bool = False
+    batcher: Optional[Batcher] = None
+    prompt_caches: Optional[PromptCacheStore] = None
+    # Background batch jobs: job id -> one future per prompt
+    jobs: OrderedDict[str, list[asyncio.Future]] = OrderedDict()
     model_id: str = ""
     load_time: float = 0
+    warmup_time: float = 0
     start_time: float = 0
     request_count: int = 0
     total_tokens_generated: int = 0
@@ -43,29 +73,344 @@ class ModelState:
 
 state = ModelState()
 
+# Character budget per input token for the pre-tokenization size check
+MAX_CHARS_PER_TOKEN = 8
+
+# Admission control: requests beyond this many in flight are rejected
+# with 429 instead of queueing without bound on the model
+inflight = asyncio.Semaphore(config.max_inflight)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Load model on startup, cleanup on shutdown"""
     logger.info(f"Loading model: {config.model_id}")
-    load_start = time.time()
+    load_start = time.perf_counter()
+
+    if config.cache_limit_mb > 0:
+        mx.set_cache_limit(config.cache_limit_mb * 1024 * 1024)
 
     try:
-        state.model, state.tokenizer = load(config.model_id)
+        state.model, state.tokenizer = load_model(
+            config.model_id,
+            bits=config.quantize_bits,
+            group_size=config.quantize_group_size,
+            save_dir=config.quantized_model_dir
+        )
         state.model_id = config.model_id
-        state.load_time = time.time() - load_start
-        state.start_time = time.time()
+        if config.draft_model_id:
+            logger.info(f"Loading draft model: {config.draft_model_id}")
+            state.draft_model, _ = load_model(
+                config.draft_model_id,
+                bits=config.quantize_bits,
+                group_size=config.quantize_group_size,
+                save_dir=config.quantized_model_dir
+            )
+            if state.draft_model.args.vocab_size != state.model.args.vocab_size:
+                # Draft token ids would not mean the same tokens to the
+                # main model, so every draft would be rejected or wrong
+                logger.warning("Draft model vocabulary differs from the main model's, disabling speculative decoding")
+                state.draft_model = None
+        state.encode = build_encoder(state.tokenizer, config.tokenizer_backend)
+        state.compiled_template = compile_chat_template(state.tokenizer)
+        state.template_vars = dict(state.tokenizer.special_tokens_map)
+        _encode_cached.cache_clear()
+        state.segmented_encoding = verify_segmented_encoding()
+        warmup_sampler(state.model.args.vocab_size)
+        state.load_time = time.perf_counter() - load_start
+        state.start_time = time.monotonic()
         logger.info(f"Model loaded in {state.load_time:.2f}s")
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
         raise RuntimeError(f"Model loading failed: {e}")
 
+    state.batcher = Batcher(
+        state.model,
+        state.tokenizer,
+        max_batch_size=config.max_batch_size,
+        batch_wait_ms=config.batch_wait_ms,
+        prefill_step_size=config.prefill_step_size,
+        length_bucket=config.length_bucket,
+        draft_model=state.draft_model,
+        num_draft_tokens=config.speculative_k
+    )
+    state.batcher.start()
+    if config.workers > 1:
+        logger.warning(
+            f"Running with {config.workers} workers: /batch jobs live in the worker "
+            "that created them, so GET /batch/{job_id} may return 404 from another worker"
+        )
+    state.prompt_caches = PromptCacheStore(state.model, max_entries=config.max_cached_convs)
+    await warmup()
+
     yield
 
     # Cleanup
     logger.info("Shutting down MLX API")
+    await state.batcher.stop()
+    state.batcher = None
+    state.prompt_caches = None
+    state.jobs.clear()
     state.model = None
+    state.draft_model = None
     state.tokenizer = None
+    state.encode = None
+    state.compiled_template = None
+    state.segmented_encoding = False
+    _encode_cached.cache_clear()
+
+
+async def warmup():
+    """
+    Run a short generation through the batcher so kernel compilation and
+    buffer allocation happen before the first real request
+    """
+    warmup_start = time.perf_counter()
+    try:
+        await state.batcher.run_in_thread(mx.eval, state.model.parameters())
+        await state.batcher.submit(
+            encode_chat([{"role": "user", "content": "hi"}]),
+            max_tokens=4,
+            temperature=config.default_temperature,
+            top_p=config.default_top_p
+        )
+    except Exception as e:
+        logger.warning(f"Warmup failed: {e}")
+    state.warmup_time = time.perf_counter() - warmup_start
+    logger.info(f"Warmup finished in {state.warmup_time:.2f}s")
+
+
+def render_chat(messages: list[dict]) -> str:
+    """Render messages into a prompt string using the precompiled chat template"""
+    if state.compiled_template is None:
+        return state.tokenizer.apply_chat_template(
+            messages,
+            add_generation_prompt=True,
+            tokenize=False
+        )
+    return state.compiled_template.render(
+        messages=messages,
+        add_generation_prompt=True,
+        **state.template_vars
+    )
+
+
+def with_bos(prompt: str, prompt_tokens: list[int]) -> list[int]:
+    """Prepend BOS unless the rendered prompt already starts with it"""
+    bos_token = state.tokenizer.bos_token
+    if bos_token is not None and not prompt.startswith(bos_token):
+        return [state.tokenizer.bos_token_id] + prompt_tokens
+    return prompt_tokens
+
+
+def encode_prompt(prompt: str) -> list[int]:
+    """Tokenize a rendered prompt without duplicating the template's BOS token"""
+    return with_bos(prompt, state.encode(prompt))
+
+
+@functools.lru_cache(maxsize=128)
+def _encode_cached(text: str) -> tuple[int, ...]:
+    return tuple(state.encode(text))
+
+
+# Message contents are rendered as " \x00<index>\x00 " so they can be
+# located in the template output; the padding shows whether the
+# template trimmed them
+_CONTENT_MARKER = re.compile(r"( ?)\x00(\d+)\x00( ?)")
+
+
+def encode_chat_segments(messages: list[dict]) -> list[int]:
+    """
+    Tokenize a conversation piecewise.
+
+    The template text between messages and each message's content are
+    encoded separately through an LRU cache, so repeated strings (the
+    system prompt, earlier turns, role headers) skip BPE entirely.
+    """
+    rendered = render_chat([
+        {"role": m["role"], "content": f" \x00{i}\x00 "} for i, m in enumerate(messages)
+    ])
+
+    prompt_tokens: list[int] = []
+    pos = 0
+    for match in _CONTENT_MARKER.finditer(rendered):
+        content = messages[int(match.group(2))]["content"]
+        if match.group(1) and match.group(3):
+            template_text, pos = rendered[pos:match.start()], match.end()
+        else:
+            # Template trimmed the content; keep any real spaces around it
+            content = content.strip()
+            template_text, pos = rendered[pos:match.start(2) - 1], match.end(2) + 1
+        for text in (template_text, content):
+            if text:
+                prompt_tokens.extend(_encode_cached(text))
+    if rendered[pos:]:
+        prompt_tokens.extend(_encode_cached(rendered[pos:]))
+
+    return with_bos(rendered, prompt_tokens)
+
+
+def encode_chat(messages: list[dict]) -> list[int]:
+    """Render and tokenize a conversation"""
+    if state.segmented_encoding and not any("\x00" in m["content"] for m in messages):
+        return encode_chat_segments(messages)
+    return encode_prompt(render_chat(messages))
+
+
+def verify_segmented_encoding() -> bool:
+    """
+    Check that piecewise encoding matches encoding the whole prompt.
+
+    Splitting at message boundaries is only safe when the tokenizer never
+    merges across them, which holds for chat templates that wrap content
+    in special tokens but is not guaranteed in general.
+    """
+    probe = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "  Hey, what's up?\n"},
+        {"role": "assistant", "content": "Not much! Just here to help 😀"},
+        {"role": "user", "content": "Tell me a joke about 42 cats."}
+    ]
+    try:
+        matches = encode_chat_segments(probe) == encode_prompt(render_chat(probe))
+    except Exception as e:
+        logger.warning(f"Segmented prompt encoding unavailable: {e}")
+        return False
+    if not matches:
+        logger.info("Chat template does not tokenize cleanly per message; encoding whole prompts")
+    return matches
+
+
+def require_model():
+    """Reject requests until the model has finished loading"""
+    if state.model is None or state.tokenizer is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Model not loaded. Server is starting up."
+        )
+
+
+@asynccontextmanager
+async def inflight_slot():
+    """Hold one of the in-flight slots, tracked by the Prometheus gauge"""
+    async with inflight:
+        with INFLIGHT.track_inprogress():
+            yield
+
+
+async def take_inflight_slot() -> Callable[[], None]:
+    """
+    Claim an in-flight slot for a streamed response, or fail with 429.
+
+    The returned function gives the slot back and may be called more
+    than once, so both the body generator and the response's background
+    task can call it.
+    """
+    check_capacity()
+    # Not locked, so this returns without waiting
+    await inflight.acquire()
+    INFLIGHT.inc()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            INFLIGHT.dec()
+            inflight.release()
+
+    return release
+
+
+def record_tokens(count: int):
+    """Add generated tokens to /stats and the Prometheus counter"""
+    state.total_tokens_generated += count
+    TOKENS_GENERATED.inc(count)
+
+
+def check_capacity():
+    """Fast-fail when the in-flight request limit has been reached"""
+    if inflight.locked():
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy: {config.max_inflight} requests already in flight"
+        )
+
+
+def prepare_prompt(request: GenerateRequest) -> tuple[list[dict], list[int]]:
+    """Render and tokenize a request's messages, enforcing the input limit"""
+    # Reject inputs that cannot fit before spending time tokenizing them;
+    # real text averages well under MAX_CHARS_PER_TOKEN characters a token
+    total_chars = sum(len(m.content) for m in request.messages)
+    if total_chars > config.max_input_tokens * MAX_CHARS_PER_TOKEN:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Input too long: {total_chars} characters (max: {config.max_input_tokens} tokens)"
+        )
+
+    # Convert messages to dict format for tokenizer
+    messages = [{"role": m.role, "content": m.content} for m in request.messages]
+
+    # Apply chat template, then tokenize once; the same ids are
+    # checked and sent to the batcher
+    prompt_tokens = encode_chat(messages)
+    input_tokens = len(prompt_tokens)
+    if input_tokens > config.max_input_tokens:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Input too long: {input_tokens} tokens (max: {config.max_input_tokens})"
+        )
+
+    return messages, prompt_tokens
+
+
+def reuse_prompt_cache(messages: list[dict], prompt_tokens: list[int]) -> tuple[Optional[list], int]:
+    """Take the KV cache left by this conversation's previous turn, if any"""
+    cache, reused = state.prompt_caches.fetch(conversation_key(messages[:-1]), prompt_tokens)
+    if reused:
+        logger.info(f"Reusing {reused}/{len(prompt_tokens)} cached prompt tokens")
+    return cache, reused
+
+
+def save_prompt_cache(messages: list[dict], prompt_tokens: list[int], result: GenerationResult):
+    """Keep the KV cache so the conversation's next turn only prefills new tokens"""
+    if result.prompt_cache is None:
+        return
+    key = conversation_key(messages + [{"role": "assistant", "content": result.text}])
+    state.prompt_caches.store(key, prompt_tokens + result.tokens, result.prompt_cache)
+
+
+async def run_generation(
+    messages: list[dict],
+    prompt_tokens: list[int],
+    max_tokens: int,
+    temperature: float,
+    top_p: float
+) -> GenerationResult:
+    """Generate within the in-flight limit and request timeout"""
+    async with inflight_slot():
+        speculative = state.batcher.can_speculate()
+        cache, reused = reuse_prompt_cache(messages, prompt_tokens)
+        try:
+            result = await asyncio.wait_for(
+                state.batcher.submit(
+                    prompt_tokens[reused:],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    cache=cache,
+                    speculative=speculative
+                ),
+                timeout=config.request_timeout
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Generation timed out after {config.request_timeout}s"
+            )
+
+    save_prompt_cache(messages, prompt_tokens, result)
+    return result
 
 
 # Create FastAPI app
@@ -73,6 +418,7 @@ app = FastAPI(
     title="iMessage MLX API",
     description="Local LLM inference for iMessage chatbot using MLX",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -86,25 +432,77 @@ app.add_middleware(
 )
 
 
+# msgspec schemas reference each other through OpenAPI components
+SCHEMA_REF_TEMPLATE = "#/components/schemas/{name}"
+
+
+def json_body(body_type):
+    """
+    Dependency decoding the request body with a prebuilt msgspec decoder,
+    in place of FastAPI's per-request Pydantic validation.
+    """
+    decoder = msgspec.json.Decoder(body_type)
+
+    async def decode(request: Request):
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    return decode
+
+
+def body_schema(body_type) -> dict:
+    """openapi_extra documenting a msgspec request body"""
+    (schema,), _ = msgspec.json.schema_components([body_type], ref_template=SCHEMA_REF_TEMPLATE)
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": schema}}
+        }
+    }
+
+
+def custom_openapi() -> dict:
+    """OpenAPI schema including the msgspec request models"""
+    if app.openapi_schema is None:
+        schema = get_openapi(
+            title=app.title,
+            version=app.version,
+            description=app.description,
+            routes=app.routes
+        )
+        _, components = msgspec.json.schema_components(REQUEST_MODELS, ref_template=SCHEMA_REF_TEMPLATE)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(components)
+        app.openapi_schema = schema
+    return app.openapi_schema
+
+
+app.openapi = custom_openapi
+
+# Prometheus scrape endpoint
+app.mount("/metrics", make_asgi_app())
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Handle all uncaught exceptions"""
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"error": "Internal server error", "detail": str(exc)}
     )
 
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health_check():
     """Health check endpoint for monitoring"""
-    return HealthResponse(
-        status="healthy" if state.model is not None else "unhealthy",
-        model=state.model_id,
-        model_loaded=state.model is not None,
-        uptime_seconds=time.time() - state.start_time if state.start_time else 0
-    )
+    return ORJSONResponse({
+        "status": "healthy" if state.model is not None else "unhealthy",
+        "model": state.model_id,
+        "model_loaded": state.model is not None,
+        "uptime_seconds": time.monotonic() - state.start_time if state.start_time else 0
+    })
 
 
 @app.get("/stats")
@@ -113,74 +511,195 @@ async def get_stats():
     return {
         "model": state.model_id,
         "model_load_time_seconds": state.load_time,
-        "uptime_seconds": time.time() - state.start_time,
+        "warmup_time_seconds": state.warmup_time,
+        "uptime_seconds": time.monotonic() - state.start_time,
         "total_requests": state.request_count,
-        "total_tokens_generated": state.total_tokens_generated
+        "total_tokens_generated": state.total_tokens_generated,
+        "prompt_cache": state.prompt_caches.stats() if state.prompt_caches else {},
+        "batching": state.batcher.stats() if state.batcher else {}
     }
 
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate_response(request: GenerateRequest):
+# Responses are built as plain dicts; the Pydantic models only document them
+@app.post(
+    "/generate",
+    responses={200: {"model": GenerateResponse}},
+    openapi_extra=body_schema(GenerateRequest)
+)
+async def generate_response(request: GenerateRequest = Depends(json_body(GenerateRequest))):
     """
     Generate a response from the LLM.
 
     Accepts a list of messages in OpenAI chat format and returns
     the model's response with generation metadata.
     """
-    if state.model is None or state.tokenizer is None:
-        raise HTTPException(
-            status_code=503,
-            detail="Model not loaded. Server is starting up."
-        )
+    require_model()
+    check_capacity()
 
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     state.request_count += 1
 
     try:
-        # Convert messages to dict format for tokenizer
-        messages = [{"role": m.role, "content": m.content} for m in request.messages]
+        messages, prompt_tokens = prepare_prompt(request)
+        logger.info(f"Generating response (input: {len(prompt_tokens)} tokens, max_output: {request.max_tokens})")
 
-        # Apply chat template
-        prompt = state.tokenizer.apply_chat_template(
+        # Generate response in the shared decode batch
+        result = await run_generation(
             messages,
-            add_generation_prompt=True,
-            tokenize=False
-        )
-
-        # Check input length
-        input_tokens = len(state.tokenizer.encode(prompt))
-        if input_tokens > config.max_input_tokens:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Input too long: {input_tokens} tokens (max: {config.max_input_tokens})"
-            )
-
-        logger.info(f"Generating response (input: {input_tokens} tokens, max_output: {request.max_tokens})")
-
-        # Generate response
-        response_text = generate(
-            state.model,
-            state.tokenizer,
-            prompt=prompt,
+            prompt_tokens,
             max_tokens=min(request.max_tokens, config.max_output_tokens),
-            temp=request.temperature,
+            temperature=request.temperature,
             top_p=request.top_p
         )
 
         # Calculate metrics
-        elapsed_ms = int((time.time() - start_time) * 1000)
-        tokens_generated = len(state.tokenizer.encode(response_text))
-        state.total_tokens_generated += tokens_generated
+        elapsed_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+        tokens_generated = len(result.tokens)
+        record_tokens(tokens_generated)
 
         logger.info(f"Generated {tokens_generated} tokens in {elapsed_ms}ms")
 
-        return GenerateResponse(
-            response=response_text,
-            tokens_generated=tokens_generated,
-            generation_time_ms=elapsed_ms,
-            model=state.model_id
+        return ORJSONResponse({
+            "response": result.text,
+            "tokens_generated": tokens_generated,
+            "generation_time_ms": elapsed_ms,
+            "model": state.model_id
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Generation failed: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Generation failed: {str(e)}"
+        )
+    finally:
+        # Timeouts and failures are observed too
+        GENERATE_LATENCY.labels("/generate").observe((time.perf_counter_ns() - start_ns) / 1e9)
+
+
+def sse_event(payload: dict) -> bytes:
+    """Encode a payload as a server-sent event"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+def completion_chunk(completion_id: str, created: int, delta: dict, finish_reason: Optional[str] = None) -> bytes:
+    """Format one chat.completion.chunk as a server-sent event"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": state.model_id,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return sse_event(chunk)
+
+
+async def stream_completion(
+    messages: list[dict],
+    prompt_tokens: list[int],
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+    completion_id: str,
+    created: int,
+    deadline: float,
+    release_slot: Callable[[], None]
+):
+    """Yield SSE chunks for a request as the batcher decodes it"""
+    # The handler took the in-flight slot; give it back however the
+    # body ends
+    try:
+        loop = asyncio.get_running_loop()
+        speculative = state.batcher.can_speculate()
+        cache, reused = reuse_prompt_cache(messages, prompt_tokens)
+        pending = state.batcher.enqueue(
+            prompt_tokens[reused:],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stream=asyncio.Queue(),
+            cache=cache,
+            speculative=speculative
+        )
+        try:
+            yield completion_chunk(completion_id, created, {"role": "assistant"})
+            while (segment := await asyncio.wait_for(pending.stream.get(), deadline - loop.time())) is not None:
+                yield completion_chunk(completion_id, created, {"content": segment})
+
+            result = await pending.future
+            record_tokens(len(result.tokens))
+            save_prompt_cache(messages, prompt_tokens, result)
+            yield completion_chunk(completion_id, created, {}, result.finish_reason)
+            yield b"data: [DONE]\n\n"
+        except asyncio.TimeoutError:
+            logger.error(f"Streaming generation timed out after {config.request_timeout}s")
+            yield sse_event({"error": f"Generation timed out after {config.request_timeout}s"})
+            yield b"data: [DONE]\n\n"
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}", exc_info=True)
+            yield sse_event({"error": f"Generation failed: {str(e)}"})
+            yield b"data: [DONE]\n\n"
+        finally:
+            # Timed out or client disconnected: drop the sequence from the batch
+            if not pending.future.done():
+                pending.future.cancel()
+    finally:
+        release_slot()
+
+
+@app.post("/v1/chat/completions", openapi_extra=body_schema(ChatCompletionRequest))
+async def chat_completions(request: ChatCompletionRequest = Depends(json_body(ChatCompletionRequest))):
+    """
+    OpenAI-compatible chat completions.
+
+    With stream=true, tokens are sent as server-sent events while the
+    batch is still decoding, so clients see the first token as soon as
+    it is sampled rather than after the full response.
+    """
+    require_model()
+    check_capacity()
+    state.request_count += 1
+
+    start_ns = time.perf_counter_ns()
+    messages, prompt_tokens = prepare_prompt(request)
+    logger.info(f"Generating response (input: {len(prompt_tokens)} tokens, max_output: {request.max_tokens})")
+    max_tokens = min(request.max_tokens, config.max_output_tokens)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if request.stream:
+        # Hold the slot from here rather than from the first body chunk,
+        # so concurrent streams are limited like /generate. The timeout
+        # also counts from here
+        deadline = asyncio.get_running_loop().time() + config.request_timeout
+        release_slot = await take_inflight_slot()
+        return StreamingResponse(
+            stream_completion(
+                messages,
+                prompt_tokens,
+                max_tokens,
+                request.temperature,
+                request.top_p,
+                completion_id,
+                created,
+                deadline,
+                release_slot
+            ),
+            media_type="text/event-stream",
+            # Releases the slot if the body is never iterated
+            background=BackgroundTask(release_slot)
         )
 
+    try:
+        result = await run_generation(
+            messages,
+            prompt_tokens,
+            max_tokens=max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -189,13 +708,126 @@ async def generate_response(request: GenerateRequest):
             status_code=500,
             detail=f"Generation failed: {str(e)}"
         )
+    finally:
+        GENERATE_LATENCY.labels("/v1/chat/completions").observe((time.perf_counter_ns() - start_ns) / 1e9)
+    record_tokens(len(result.tokens))
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": state.model_id,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": result.text},
+            "finish_reason": result.finish_reason
+        }],
+        "usage": {
+            "prompt_tokens": len(prompt_tokens),
+            "completion_tokens": len(result.tokens),
+            "total_tokens": len(prompt_tokens) + len(result.tokens)
+        }
+    }
+
+
+def batch_result(future: asyncio.Future) -> dict:
+    """Result entry for one prompt of a finished batch job"""
+    if future.cancelled():
+        return {"error": "Cancelled"}
+    if future.exception() is not None:
+        return {"error": str(future.exception())}
+    result = future.result()
+    return {"response": result.text, "tokens_generated": len(result.tokens)}
+
+
+def job_status(job_id: str, futures: list[asyncio.Future]) -> dict:
+    """Progress of a batch job, with its results once every prompt is done"""
+    completed = sum(f.done() for f in futures)
+    status = {
+        "job_id": job_id,
+        "status": "running",
+        "completed": completed,
+        "total": len(futures)
+    }
+    if completed == len(futures):
+        status["status"] = "completed"
+        status["results"] = [batch_result(f) for f in futures]
+    return status
+
+
+def count_tokens(future: asyncio.Future):
+    """Add a finished background generation to the token total"""
+    if not future.cancelled() and future.exception() is None:
+        record_tokens(len(future.result().tokens))
+
+
+def evict_finished_jobs():
+    """Forget the oldest completed jobs once the job limit is reached"""
+    for job_id in [j for j, futures in state.jobs.items() if all(f.done() for f in futures)]:
+        if len(state.jobs) < config.max_batch_jobs:
+            break
+        del state.jobs[job_id]
+
+
+@app.post(
+    "/batch",
+    status_code=202,
+    response_model=BatchJobResponse,
+    openapi_extra=body_schema(BatchRequest)
+)
+async def create_batch(requests: list[GenerateRequest] = Depends(json_body(BatchRequest))):
+    """
+    Queue prompts for background generation.
+
+    Background prompts only join the decode batch while no live request
+    is waiting and there are free slots, so they use spare capacity
+    without slowing down replies. Poll GET /batch/{job_id} for results.
+    """
+    require_model()
+    evict_finished_jobs()
+    if len(state.jobs) >= config.max_batch_jobs:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many batch jobs in progress (max: {config.max_batch_jobs})"
+        )
+    state.request_count += 1
+
+    prompts = [prepare_prompt(request) for request in requests]
+    futures = []
+    for request, (_, prompt_tokens) in zip(requests, prompts):
+        pending = state.batcher.enqueue(
+            prompt_tokens,
+            max_tokens=min(request.max_tokens, config.max_output_tokens),
+            temperature=request.temperature,
+            top_p=request.top_p,
+            priority=BACKGROUND
+        )
+        pending.future.add_done_callback(count_tokens)
+        futures.append(pending.future)
+
+    job_id = f"batch-{uuid.uuid4().hex}"
+    state.jobs[job_id] = futures
+    logger.info(f"Queued batch job {job_id} ({len(futures)} prompts)")
+    return job_status(job_id, futures)
+
+
+@app.get("/batch/{job_id}", response_model=BatchJobResponse)
+async def get_batch(job_id: str):
+    """Progress and results of a batch job"""
+    futures = state.jobs.get(job_id)
+    if futures is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {job_id}")
+    return job_status(job_id, futures)
 
 
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
-        app,
+        "server:app",
         host=config.host,
         port=config.port,
+        workers=config.workers,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
@@ -0,0 +1,133 @@
+"""
+Prompt encoding backends
+
+"default" encodes with the Hugging Face tokenizer. "tiktoken" rebuilds
+the same byte-level BPE as a tiktoken Encoding, whose pre-tokenizer regex
+and merge loop are considerably faster. The tiktoken encoder is only used
+when the vocab ids follow the merge order and it reproduces the Hugging
+Face ids exactly on a set of probe strings.
+"""
+import json
+import logging
+from typing import Callable
+
+logger = logging.getLogger("mlx-api.tokenizer")
+
+BACKENDS = ("default", "tiktoken")
+
+# GPT-2 pre-tokenizer pattern, used by ByteLevel when it does its own split
+_GPT2_PATTERN = r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+
+_PROBES = [
+    "Hello, how are you?",
+    "  leading and trailing spaces  ",
+    "Line one\n\nLine two\r\n\tindented",
+    "Numbers 1234567 and 3.14159, emoji 😀👍 and accents: café naïve",
+    "中文测试 日本語のテキスト 한국어",
+    "I'M SURE they'll say it's fine",
+]
+
+
+def _bytes_to_unicode() -> dict[int, str]:
+    """GPT-2's reversible mapping from bytes to printable unicode characters"""
+    bs = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+def _split_pattern(pre_tokenizer: dict) -> str:
+    steps = pre_tokenizer.get("pretokenizers", [pre_tokenizer])
+    for step in steps:
+        if step["type"] == "Split":
+            return step["pattern"]["Regex"]
+        if step["type"] == "ByteLevel" and step.get("use_regex", True):
+            return _GPT2_PATTERN
+    raise ValueError("No pre-tokenizer split pattern found")
+
+
+def _check_merge_ranks(model: dict):
+    """
+    Require vocab ids to follow the merge order.
+
+    tiktoken applies the merge whose result has the lowest rank, while
+    the Hugging Face BPE applies the earliest listed merge. Using vocab
+    ids as ranks only gives the same merges when each merge produces a
+    token with a higher id than every merge listed before it.
+    """
+    vocab = model["vocab"]
+    last_rank = -1
+    for merge in model["merges"]:
+        left, right = merge.split(" ", 1) if isinstance(merge, str) else merge
+        rank = vocab.get(left + right)
+        if rank is None or rank <= last_rank:
+            raise ValueError(f"Merge {left!r} + {right!r} is out of vocab rank order")
+        last_rank = rank
+
+
+def _to_tiktoken(tokenizer):
+    import tiktoken
+
+    spec = json.loads(tokenizer.backend_tokenizer.to_str())
+    model = spec["model"]
+    if model["type"] != "BPE" or spec.get("normalizer") is not None:
+        raise ValueError("Only un-normalized byte-level BPE tokenizers are supported")
+    _check_merge_ranks(model)
+
+    byte_decoder = {c: b for b, c in _bytes_to_unicode().items()}
+    mergeable_ranks = {
+        bytes(byte_decoder[c] for c in token): rank
+        for token, rank in model["vocab"].items()
+    }
+    special_tokens = {t["content"]: t["id"] for t in spec.get("added_tokens", [])}
+
+    return tiktoken.Encoding(
+        name="mlx-api",
+        pat_str=_split_pattern(spec["pre_tokenizer"]),
+        mergeable_ranks=mergeable_ranks,
+        special_tokens=special_tokens
+    )
+
+
+def build_encoder(tokenizer, backend: str) -> Callable[[str], list[int]]:
+    """
+    Return a function encoding text to ids without adding special tokens.
+
+    Special tokens written literally in the text (e.g. chat template
+    headers) are recognised by both backends.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown tokenizer backend: {backend} (expected one of {BACKENDS})")
+
+    def hf_encode(text: str) -> list[int]:
+        return tokenizer.encode(text, add_special_tokens=False)
+
+    if backend == "default":
+        return hf_encode
+
+    try:
+        encoding = _to_tiktoken(tokenizer)
+    except Exception as e:
+        logger.warning(f"tiktoken backend unavailable, using default tokenizer: {e}")
+        return hf_encode
+
+    def tiktoken_encode(text: str) -> list[int]:
+        return encoding.encode(text, allowed_special="all")
+
+    probes = _PROBES + ["".join(encoding.special_tokens_set) + _PROBES[0]]
+    for probe in probes:
+        if tiktoken_encode(probe) != hf_encode(probe):
+            logger.warning("tiktoken encoding does not match this tokenizer, using default tokenizer")
+            return hf_encode
+
+    logger.info("Using tiktoken backend for prompt encoding")
+    return tiktoken_encode